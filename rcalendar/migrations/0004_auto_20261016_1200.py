@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.0 on 2026-10-16 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rcalendar', '0003_auto_20160914_1734'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='interval',
+            index=models.Index(fields=['resource', 'start', 'end'], name='interval_resource_start_end'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.0 on 2026-10-16 12:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rcalendar', '0004_auto_20261016_1200'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='interval',
+            index=models.Index(fields=['resource', 'kind', 'start', 'end'], name='interval_resource_kind_start'),
+        ),
+        migrations.AddIndex(
+            model_name='interval',
+            index=models.Index(fields=['resource', 'organization', 'kind', 'start'], name='interval_resource_org_kind'),
+        ),
+        migrations.AddIndex(
+            model_name='interval',
+            index=models.Index(fields=['resource', 'manager', 'kind', 'start'], name='interval_resource_mgr_kind'),
+        ),
+        migrations.AlterField(
+            model_name='interval',
+            name='resource',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='intervals', to='rcalendar.Resource'),
+        ),
+    ]
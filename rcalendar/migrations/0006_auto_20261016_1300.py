@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.0 on 2026-10-16 13:00
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count
+
+
+def check_duplicates(apps, schema_editor):
+    """Перед добавлением ограничения (app, msa_id) убеждаемся, что дубликатов нет (иначе - понятная ошибка)."""
+    for model_name in ('Organization', 'Manager'):
+        model = apps.get_model('rcalendar', model_name)
+        duplicates = list(model.objects.values('app', 'msa_id').annotate(n=Count('id')).filter(n__gt=1)[:10])
+        if duplicates:
+            raise RuntimeError('%s has duplicated (app, msa_id), remove them before migrating: %s'
+                               % (model_name, duplicates))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rcalendar', '0005_auto_20261016_1230'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicates, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='organization',
+            unique_together={('app', 'msa_id')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='manager',
+            unique_together={('app', 'msa_id')},
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.0 on 2026-10-16 13:30
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count
+
+
+def check_duplicates(apps, schema_editor):
+    """Перед добавлением ограничения (app, msa_id) убеждаемся, что дубликатов ресурсов нет (иначе - понятная ошибка)."""
+    model = apps.get_model('rcalendar', 'Resource')
+    duplicates = list(model.objects.values('app', 'msa_id').annotate(n=Count('id')).filter(n__gt=1)[:10])
+    if duplicates:
+        raise RuntimeError('Resource has duplicated (app, msa_id), remove them before migrating: %s' % duplicates)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rcalendar', '0006_auto_20261016_1300'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicates, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='resource',
+            unique_together={('app', 'msa_id')},
+        ),
+    ]
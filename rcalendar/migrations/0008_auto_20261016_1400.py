@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.0 on 2026-10-16 14:00
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rcalendar', '0007_auto_20261016_1330'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='interval',
+            name='interval_resource_org_kind',
+        ),
+        migrations.RemoveIndex(
+            model_name='interval',
+            name='interval_resource_mgr_kind',
+        ),
+    ]
@@ -1,12 +1,14 @@
-from typing import List, Optional, Union
+from typing import Iterable, List, Optional, Union
+from collections import defaultdict
 import uuid
 import datetime
 
-from django.db import models
-from django.db.models import Q, Min, Max
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import Q
 from django.db.models.query import QuerySet
 from django.utils.translation import ugettext_lazy as _
-from django.utils.timezone import get_default_timezone
+from django.utils import timezone
 from pytz import utc as UTC
 
 from . import utils, exceptions
@@ -89,11 +91,11 @@ class Resource(ApiModelMixIn):
         if changed:
             affected_managers = Interval.objects.filter(resource=self).between(i.start, i.end).managers()
             for m in affected_managers:
-                orgs = m.organizations_for_resource(self)
+                org = m.organizations_for_resource(self).first()
                 EventDispatcher.push_event_to_response(kind='clear-unavailable-interval',
                                                        resource=self.msa_id,
                                                        manager=m.msa_id,
-                                                       organization=orgs[0].msa_id if orgs else None,
+                                                       organization=org.msa_id if org else None,
                                                        duration=[start, end],
                                                        timedelta=end - start)
         return changed
@@ -115,30 +117,26 @@ class IntervalQuerySet(QuerySet):
             if include_end_date:
                 end += datetime.timedelta(days=1)
             end = utils.datetime_from_date(end)
-        return self.filter(Q(start__lte=start, end__gte=end) |
-                           Q(start__range=(start, end)) |
-                           Q(end__range=(start, end))) \
-                   .exclude(start=end).exclude(end=start)
+        # интервал пересекается с промежутком, если начинается до его конца и заканчивается после его начала
+        return self.filter(start__lt=end, end__gt=start)
 
     def at_date(self, dt: DateOrDatetime) -> QuerySet:
         """Возвращает QS с интервалами, пересекающимися (не пограничными) с указанной dt."""
         if not isinstance(dt, datetime.datetime):
             dt = utils.datetime_from_date(dt)
-        return self.filter(Q(start__lt=dt, end__gt=dt))
+        return self.filter(start__lt=dt, end__gt=dt)
 
     def similar(self, interval: 'Interval') -> QuerySet:
         """
         Возвращает QS с интервалами, совпадающими с переданным interval по основным полям:
         resource, kind, organization, manager.
         """
-        q = Q(resource=interval.resource, kind=interval.kind,
-              organization=interval.organization, manager=interval.manager)
-
         # если интервал для организации, разных менеджеров не учитываем
         # if interval.kind != Interval.Kind_OrganizationReserved:
-        #     q &= Q()
+        #     ...
 
-        qs = self.filter(q)
+        qs = self.filter(resource=interval.resource_id, kind=interval.kind,
+                         organization=interval.organization_id, manager=interval.manager_id)
 
         if interval.id:
             qs = qs.exclude(id=interval.id)
@@ -149,11 +147,16 @@ class IntervalQuerySet(QuerySet):
         Определяет, представляют ли интервалы в данном QS непрерывный отрезок во времени между start и end.
         Возвращает результат проверки (bool).
         """
-        existing = []
-        for interval in self:
-            interval.join_with_existing(existing, timedelta=0)
-            existing.append(interval)
-        return len(existing) == 1 and existing[0].start <= start and existing[0].end >= end
+        return Interval.are_continuous(self, start, end)
+
+    def for_serialization(self) -> QuerySet:
+        """
+        Возвращает QS, подготовленный для IntervalSerializer: связанные объекты выбираются тем же запросом,
+        и из них только msa_id.
+        """
+        return self.select_related('resource', 'organization', 'manager').only(
+            'start', 'end', 'kind', 'comment', 'resource__msa_id', 'organization__msa_id', 'manager__msa_id'
+        )
 
     def managers(self) -> QuerySet:
         """
@@ -173,6 +176,9 @@ class Interval(models.Model):
     """
     EXTENDABLE_INTERVALS_MIN_DURATION = datetime.timedelta(days=40)
     JOIN_GAP = datetime.timedelta(minutes=5)
+    # продление расписания на долгий срок дает тысячи интервалов; psycopg2 подставляет параметры на стороне клиента,
+    # так что размер пачки ограничивает длину текста одного INSERT и память на его сборку
+    BULK_CREATE_BATCH_SIZE = 1000
 
     Kind_OrganizationReserved = 0
     Kind_ManagerReserved = 10
@@ -183,10 +189,12 @@ class Interval(models.Model):
         (Kind_ManagerReserved, 'manager'),
         (Kind_Unavailable, 'unavailable'),
     )
+    KIND_BY_NAME = {name: kind for kind, name in KIND_CHOICES}
 
     start = models.DateTimeField()
     end = models.DateTimeField()
-    resource = models.ForeignKey("Resource", related_name='intervals', on_delete=models.CASCADE)
+    # отдельный индекс по resource не нужен - его покрывают составные индексы (см. Meta.indexes)
+    resource = models.ForeignKey("Resource", related_name='intervals', on_delete=models.CASCADE, db_index=False)
     kind = models.SmallIntegerField(_('Interval kind'), choices=KIND_CHOICES, default=KIND_CHOICES[0][0])
     organization = models.ForeignKey(Organization, related_name='reserved_intervals', null=True,
                                      on_delete=models.CASCADE)
@@ -197,6 +205,12 @@ class Interval(models.Model):
 
     class Meta:
         ordering = ('kind', 'manager')
+        # запросы к интервалам всегда ограничены ресурсом и промежутком времени (between);
+        # фильтры по организации/менеджеру применяются к уже выбранным по индексу строкам
+        indexes = [
+            models.Index(fields=['resource', 'start', 'end'], name='interval_resource_start_end'),
+            models.Index(fields=['resource', 'kind', 'start', 'end'], name='interval_resource_kind_start'),
+        ]
 
     def __str__(self):
         return '%s interval [%s - %s]' % (self.get_kind_display(), self.start, self.end)
@@ -204,10 +218,19 @@ class Interval(models.Model):
     @classmethod
     def kind_from_str(cls, kind_str: str) -> int:
         """Возвращает значение флага KIND_CHOICES по имени метки (при отсутствии совпадений вернет 0)."""
-        for choice in cls.KIND_CHOICES:
-            if choice[1] == kind_str:
-                return choice[0]
-        return 0
+        return cls.KIND_BY_NAME.get(kind_str, 0)
+
+    @staticmethod
+    def are_continuous(intervals: Iterable['Interval'], start: datetime.datetime, end: datetime.datetime) -> bool:
+        """
+        Определяет, представляют ли интервалы intervals непрерывный отрезок во времени между start и end.
+        Возвращает результат проверки (bool).
+        """
+        existing = []
+        for interval in intervals:
+            interval.join_with_existing(existing, timedelta=0)
+            existing.append(interval)
+        return len(existing) == 1 and existing[0].start <= start and existing[0].end >= end
 
     def get_object(self, msa_id_only=False) -> [int, Organization, Manager, None]:
         """
@@ -280,34 +303,35 @@ class Interval(models.Model):
         changed = False
 
         if do_save:
-            d = qs.aggregate(Min('start'), Max('end'))
-            if d['start__min'] and d['end__max']:
-                self.start = min(d['start__min'], self.start)
-                self.end = max(d['end__max'], self.end)
-                qs.delete()
+            rows = list(qs.values_list('id', 'start', 'end'))
+            if rows:                    # при отсутствии соседних интервалов удалять нечего
+                ids, starts, ends = zip(*rows)
+                self.start = min(min(starts), self.start)
+                self.end = max(max(ends), self.end)
+                Interval.objects.filter(id__in=ids).delete()
                 changed = True
         elif do_append:
+            removed = set()     # id() склеенных интервалов, список пересобирается после цикла
             for interval in existing:
                 if interval.start >= self.start and interval.end <= self.end:   # имеющийся - внутри
-                    existing.remove(interval)
-                    changed = True
+                    removed.add(id(interval))
                 elif interval.start < self.start and interval.end > self.end:  # имеющийся - снаружи
-                    existing.remove(interval)
+                    removed.add(id(interval))
                     self.start = interval.start
                     self.end = interval.end
-                    changed = True
                 elif interval.start < self.start < interval.end or\
                         (self.start > interval.end and self.start - interval.end < timedelta):
                     # пересекаются или соприкасаются
                     self.start = interval.start
-                    existing.remove(interval)
-                    changed = True
+                    removed.add(id(interval))
                 elif interval.start < self.end < interval.end or\
                         (interval.start > self.end and interval.start - self.end < timedelta):
                     # пересекаются или соприкасаются
                     self.end = interval.end
-                    existing.remove(interval)
-                    changed = True
+                    removed.add(id(interval))
+            if removed:
+                existing[:] = [i for i in existing if id(i) not in removed]
+                changed = True
 
         return changed
 
@@ -323,23 +347,25 @@ class Interval(models.Model):
         do_save = isinstance(qs, models.QuerySet)
         do_append = isinstance(existing, list)
         changed = False
+        removed = set()     # id() удалённых из списка интервалов, список пересобирается после цикла
+        new_parts = []      # вторые части разрезанных интервалов, записываются в бд одним запросом
 
-        for interval in qs:
+        for interval in (list(qs) if do_append else qs):
             if interval.start < self.start and interval.end > self.end:        # снаружи
                 changed = True
                 end_old = interval.end
                 interval.end = self.start
                 if do_save:
-                    interval.save(join_existing=False, trim=False, events=False)
+                    interval.save(join_existing=False, trim=False, events=False, validate=False)
                 i2 = Interval(start=self.end,
                               end=end_old,
                               kind=interval.kind,
-                              resource=interval.resource,
-                              manager=interval.manager,
-                              organization=interval.organization,
+                              resource_id=interval.resource_id,
+                              manager_id=interval.manager_id,
+                              organization_id=interval.organization_id,
                               comment=interval.comment)
                 if do_save:
-                    i2.save(join_existing=False, trim=False, events=False)
+                    new_parts.append(i2)
                 if do_append:
                     existing.append(i2)
 
@@ -347,32 +373,32 @@ class Interval(models.Model):
                 changed = True
                 interval.end = self.start
                 if do_save:
-                    interval.save(join_existing=False, trim=False, events=False)
+                    interval.save(join_existing=False, trim=False, events=False, validate=False)
 
             elif interval.start < self.end < interval.end:                     # пересекаются
                 changed = True
                 interval.start = self.end
                 if do_save:
-                    interval.save(join_existing=False, trim=False, events=False)
+                    interval.save(join_existing=False, trim=False, events=False, validate=False)
 
             elif interval.start >= self.start and interval.end <= self.end:    # внутри
                 changed = True
                 if do_save:
                     interval.delete(events=False)
                 if do_append:
-                    existing.remove(interval)
+                    removed.add(id(interval))
+
+        if new_parts:
+            Interval.objects.bulk_create(new_parts, batch_size=Interval.BULK_CREATE_BATCH_SIZE)
+        if removed:
+            existing[:] = [i for i in existing if id(i) not in removed]
         return changed
 
-    # noinspection PyUnresolvedReferences
-    def save(self, join_existing=True, trim=True, events=True, *args, **kwargs):
+    def check_validity(self, qs: QuerySet):
         """
-        Переопределяет функцию Model.save с доп. аргументами.
-        Перед сохранением производит необходимые проверки на валидность данного интервала
-        (при ошибке вызывается ValidationError).
+        Проверяет валидность данного интервала перед сохранением, при ошибке вызывает FormError.
 
-        :param join_existing: склеивать с имеющимися интервалами в бд или нет
-        :param trim: обрезать имеющиеся интервалы в бд или нет
-        :param events: генерировать ли пользовательские события или нет
+        :param qs: интервалы того же ресурса, пересекающиеся с данным (кроме него самого)
         """
         if self.start >= self.end:
             raise exceptions.FormError('end', _('End date must be greater than start date.'))
@@ -382,44 +408,70 @@ class Interval(models.Model):
             raise exceptions.FormError('organization', _('You must specify organization for this interval.'))
 
         # указанный менеджер должен состоять в указанной организации
-        if self.organization_id and self.manager_id and self.organization not in self.manager.organizations.all():
+        if self.organization_id and self.manager_id \
+                and not Manager.organizations.through.objects.filter(manager=self.manager_id,
+                                                                     organization=self.organization_id).exists():
             raise exceptions.FormError('', _('Only managers can reserve time for organization.'))
 
         # указанный ресурс должен состоять в указанной организации
         if self.organization_id and self.resource_id \
-                and not self.organization.resource_members.filter(resource=self.resource).count():
+                and not ResourceMembership.objects.filter(organization=self.organization_id,
+                                                          resource=self.resource_id).exists():
             raise exceptions.FormError('', _('Resource is not in specified organization.'))
 
-        qs = Interval.objects.between(self.start, self.end).filter(resource=self.resource)
-        if self.pk:
-            qs = qs.exclude(id=self.id)
-
         if self.kind == Interval.Kind_ManagerReserved:
             if not self.manager_id:
                 raise exceptions.FormError('manager', _('You must specify manager for this interval.'))
 
-            if not qs.filter(kind=Interval.Kind_OrganizationReserved, organization=self.organization)\
-                     .is_continuous(self.start, self.end):
+            # все проверки выполняются по одной выборке интервалов организаций и менеджеров
+            nearby = list(qs.filter(kind__in=(Interval.Kind_OrganizationReserved, Interval.Kind_ManagerReserved))
+                            .only('start', 'end', 'kind', 'organization', 'manager'))
+            org_reserved = [i for i in nearby if i.kind == Interval.Kind_OrganizationReserved and
+                            i.organization_id == self.organization_id]
+            manager_reserved = [i for i in nearby if i.kind == Interval.Kind_ManagerReserved]
+
+            if not Interval.are_continuous(org_reserved, self.start, self.end):
                 raise exceptions.FormError('', _('This period is\'t fall within organization time.'))
 
-            if qs.filter(kind=Interval.Kind_ManagerReserved).exclude(manager=self.manager):
+            if any(i.manager_id != self.manager_id for i in manager_reserved):
                 raise exceptions.FormError('', _('This period is reserved for another manager.'))
 
-            if qs.filter(kind=Interval.Kind_ManagerReserved, organization=self.organization, manager=self.manager)\
-                 .is_continuous(self.start, self.end):
+            if Interval.are_continuous([i for i in manager_reserved if i.organization_id == self.organization_id],
+                                       self.start, self.end):
                 raise exceptions.FormError('', _('This period is already reserved.'))
 
         elif self.kind == Interval.Kind_OrganizationReserved:
             if qs.filter(kind=Interval.Kind_OrganizationReserved, organization=self.organization)\
-                 .is_continuous(self.start, self.end):
+                 .only('start', 'end').is_continuous(self.start, self.end):
                 raise exceptions.FormError('', _('This period is already reserved for organization.'))
 
-            if qs.filter(kind=Interval.Kind_OrganizationReserved).exclude(organization=self.organization):
+            if qs.filter(kind=Interval.Kind_OrganizationReserved).exclude(organization=self.organization).exists():
                 raise exceptions.FormError('', _('This period falls within another organization.'))
 
-            for membership in self.resource.organization_memberships.exclude(organization=self.organization):
-                if membership.schedule_intervals.has_intersection(self):
-                    raise exceptions.FormError('', _('This period falls within another organization\'s schedule.'))
+            # расписания ресурса во всех других организациях проверяем одним запросом
+            other_schedules = ScheduleInterval.objects.filter(membership__resource=self.resource_id)\
+                                                      .exclude(membership__organization=self.organization_id)
+            if other_schedules.has_intersection(self):
+                raise exceptions.FormError('', _('This period falls within another organization\'s schedule.'))
+
+    # noinspection PyUnresolvedReferences
+    def save(self, join_existing=True, trim=True, events=True, validate=True, *args, **kwargs):
+        """
+        Переопределяет функцию Model.save с доп. аргументами.
+        Перед сохранением производит необходимые проверки на валидность данного интервала
+        (при ошибке вызывается ValidationError).
+
+        :param join_existing: склеивать с имеющимися интервалами в бд или нет
+        :param trim: обрезать имеющиеся интервалы в бд или нет
+        :param events: генерировать ли пользовательские события или нет
+        :param validate: производить ли проверки на валидность (не нужны, если интервал только сокращается)
+        """
+        qs = Interval.objects.between(self.start, self.end).filter(resource=self.resource_id)
+        if self.pk:
+            qs = qs.exclude(id=self.id)
+
+        if validate:
+            self.check_validity(qs)
 
         joined = False
         if join_existing:
@@ -436,12 +488,12 @@ class Interval(models.Model):
 
             if self.kind == Interval.Kind_Unavailable:
                 for m in qs.managers():
-                    orgs = m.organizations_for_resource(self.resource)
+                    org = m.organizations_for_resource(self.resource).first()
                     EventDispatcher.push_event_to_response(kind='add-unavailable-interval',
                                                            comment=self.comment,
                                                            resource=self.resource.msa_id,
                                                            manager=m.msa_id,
-                                                           organization=orgs[0].msa_id if orgs else None,
+                                                           organization=org.msa_id if org else None,
                                                            duration=[self.start, self.end],
                                                            timedelta=self.end - self.start)
 
@@ -452,21 +504,25 @@ class Interval(models.Model):
         :param events: генерировать ли пользовательские события или нет
         """
         if events:
-            EventDispatcher.push_event_to_response(kind='delete-interval', **self.get_event_context())
-
-            if self.kind == Interval.Kind_Unavailable:
-                affected_managers = Interval.objects.filter(resource=self.resource)\
-                    .between(self.start, self.end).managers()
-                for m in affected_managers:
-                    orgs = m.organizations_for_resource(self.resource)
-                    EventDispatcher.push_event_to_response(kind='clear-unavailable-interval',
-                                                           resource=self.resource.msa_id,
-                                                           manager=m.msa_id,
-                                                           organization=orgs[0].msa_id if orgs else None,
-                                                           duration=[self.start, self.end],
-                                                           timedelta=self.end - self.start)
+            self.push_delete_events()
         return super().delete(**kwargs)
 
+    def push_delete_events(self):
+        """Генерирует пользовательские события об удалении данного интервала (без удаления из бд)."""
+        EventDispatcher.push_event_to_response(kind='delete-interval', **self.get_event_context())
+
+        if self.kind == Interval.Kind_Unavailable:
+            affected_managers = Interval.objects.filter(resource=self.resource)\
+                .between(self.start, self.end).managers()
+            for m in affected_managers:
+                org = m.organizations_for_resource(self.resource).first()
+                EventDispatcher.push_event_to_response(kind='clear-unavailable-interval',
+                                                       resource=self.resource.msa_id,
+                                                       manager=m.msa_id,
+                                                       organization=org.msa_id if org else None,
+                                                       duration=[self.start, self.end],
+                                                       timedelta=self.end - self.start)
+
     def get_event_context(self) -> dict:
         """Возвращает словарь аттрибутов данного интервала, полезный при создании пользовательских событий."""
         d = dict(
@@ -483,6 +539,37 @@ class Interval(models.Model):
         return d
 
 
+class ResourceMembershipQuerySet(QuerySet):
+    """Менеджер объектов для модели ResourceMembership."""
+
+    def with_schedule(self) -> QuerySet:
+        """
+        Возвращает QS с подгруженными ресурсом, организацией и интервалами расписания,
+        которые используются при продлении расписания (extend_schedule).
+        """
+        return self.select_related('resource', 'organization').prefetch_related('schedule_intervals')
+
+    def extend_schedules(self, end: datetime.datetime):
+        """
+        Продлевает расписание для всех объектов данного QS до end (см. ResourceMembership.extend_schedule).
+        Сначала без блокировки выбираются объекты, расписание которых продлено не до end (без даты продления
+        продлевать нечего - см. extend_schedule); если таких нет, транзакция не открывается.
+        Найденные строки блокируются в порядке pk (чтобы одновременные запросы с пересекающимися наборами
+        не взаимоблокировались) до подгрузки расписаний, условие перепроверяется под блокировкой.
+        Все изменения выполняются в одной транзакции, дата продления обновляется одним запросом.
+        """
+        outdated_ids = list(self.filter(schedule_extended_date__lt=end).values_list('id', flat=True))
+        if not outdated_ids:
+            return
+        with transaction.atomic():
+            locked = ResourceMembership.objects.filter(id__in=outdated_ids).select_for_update(of=('self',))\
+                .order_by('pk').with_schedule()
+            # под блокировкой schedule_extended_date актуальна: уже продлённые другим запросом пропускаются
+            extended_ids = [m.id for m in locked if m.extend_schedule(end, save=False, lock=False)]
+            if extended_ids:
+                ResourceMembership.objects.filter(id__in=extended_ids).update(schedule_extended_date=end)
+
+
 class ResourceMembership(models.Model):
     """
     Модель, связывающая организацию и ресурс.
@@ -492,54 +579,86 @@ class ResourceMembership(models.Model):
     organization = models.ForeignKey(Organization, related_name='resource_members', on_delete=models.CASCADE)
     schedule_extended_date = models.DateTimeField(null=True)
 
+    objects = ResourceMembershipQuerySet.as_manager()
+
     class Meta:
         unique_together = ('resource', 'organization')
 
     @property
     def has_schedule(self) -> bool:
         """Возвращает True при наличии объектов ScheduleInterval, связанных с данным."""
-        return self.schedule_intervals.count() > 0
+        return self.schedule_intervals.exists()
 
     def strip_organization_time(self):
         """
         Cокращает выделенное время ресурса для организации до окончания времени,
         выделенного каким-либо менеджером данной орг-ии
         """
-        now = datetime.datetime.now(get_default_timezone())
+        now = timezone.now()
         self.schedule_extended_date = now
-        for i in Interval.objects.at_date(now).filter(resource=self.resource, organization=self.organization):
-            i.end = now
-            i.save()
+        # интервалы только сокращаются, поэтому проверки Interval.save не нужны
+        Interval.objects.at_date(now).filter(resource=self.resource_id, organization=self.organization_id)\
+                                     .update(end=now)
 
-    def extend_schedule(self, end: datetime.datetime):
+    def lock(self):
+        """
+        Блокирует строку данного объекта (select_for_update) до конца текущей транзакции
+        и перечитывает schedule_extended_date; расписание, подгруженное через prefetch_related, сбрасывается,
+        чтобы после блокировки читалось актуальное.
+        """
+        self.schedule_extended_date = ResourceMembership.objects.select_for_update()\
+            .values_list('schedule_extended_date', flat=True).get(pk=self.pk)
+        getattr(self, '_prefetched_objects_cache', {}).pop('schedule_intervals', None)
+
+    def extend_schedule(self, end: datetime.datetime, save=True, lock=True) -> bool:
         """
         Создаёт интервалы, отмечающие время работы данного ресурса в данной организации, в промежутке между
         self.schedule_extended_date и end.
         Если значение self.schedule_extended_date меньше end, ничего не делает.
+
+        :param save: сохранять ли новое значение schedule_extended_date в бд
+        :param lock: блокировать ли строку перед чтением (False, если она уже заблокирована вызывающим кодом)
+        :return: было ли продлено расписание
         """
-        if self.schedule_extended_date and self.schedule_extended_date >= end:
-            return
-        if self.apply_schedule(self.schedule_extended_date, end):
+        with transaction.atomic():
+            if lock:
+                self.lock()
+            if self.schedule_extended_date and self.schedule_extended_date >= end:
+                return False
+            if not self.apply_schedule(self.schedule_extended_date, end, lock=False):
+                return False
             self.schedule_extended_date = end
-            self.save()
+            if save:
+                self.save(update_fields=('schedule_extended_date',))
+        return True
 
+    @transaction.atomic
     def apply_schedule(self, start: datetime.datetime, end: datetime.datetime,
-                       schedule_intervals: 'ScheduleIntervalList'=None, save_as_default=False) -> bool:
+                       schedule_intervals: 'ScheduleIntervalList'=None, save_as_default=False, lock=True) -> bool:
         """
         Cоздает новые интервалы доступности ресурса для организации взамен старых.
+        Выполняется в одной транзакции; одновременные изменения расписания одного и того же
+        объекта выполняются последовательно: строка блокируется (см. lock) до чтения расписания.
 
         :param schedule_intervals: список интервалов графика (если None, берет имеющиеся)
         :param save_as_default: сохранять переданные schedule_intervals в качестве постоянных или нет
         :param start: дата и время начала
         :param end: дата и время окончания
+        :param lock: блокировать ли строку (False, если она уже заблокирована вызывающим кодом)
         :return: были созданы новые интервалы или нет
         """
-        if not (schedule_intervals or self.schedule_intervals.count()):
-            return False
         if not start or not end or start >= end:
             return False
 
-        used_scedule_intervals = schedule_intervals if schedule_intervals is not None else self.schedule_intervals.all()
+        if lock:
+            self.lock()
+
+        # имеющееся расписание выбираем одним запросом (или берём из prefetch_related)
+        stored_schedule_intervals = list(self.schedule_intervals.all()) if not schedule_intervals else None
+        if not (schedule_intervals or stored_schedule_intervals):
+            return False
+
+        used_scedule_intervals = schedule_intervals if schedule_intervals is not None else stored_schedule_intervals
 
         # очищаем имеющиеся интервалы работы для выбранного отрезка времени
         work_interval = Interval(start=start, end=end)
@@ -549,53 +668,50 @@ class ResourceMembership(models.Model):
                                      kind=Interval.Kind_OrganizationReserved)
         work_interval.substract_from_existing(qs)
 
-        intervals = []      # создаваемые интервалы
-        schedule_intervals_map = {}     # раскладываем интервалы графика в словарь {день_недели: интервал графика}
+        ranges = []         # отрезки (start, end) создаваемых интервалов
+        # раскладываем интервалы графика в словарь {день_недели: интервал графика}
+        schedule_intervals_map = defaultdict(list)
 
         for si in used_scedule_intervals:
-            if si.start.tzinfo is None:                  # добавляем временную зону
-                si.start = si.start.replace(tzinfo=UTC())
-            if si.end.tzinfo is None:
-                si.end = si.end.replace(tzinfo=UTC())
-
-            schedule_intervals_map.setdefault(si.day_of_week, [])
-            schedule_intervals_map[si.day_of_week].append(si)
-
+            # время начала и окончания (всегда в UTC, см. ScheduleInterval.__init__)
+            # храним как смещения от начала дня
+            start_offset = utils.timedelta_from_time(si.start)
+            end_offset = utils.timedelta_from_time(si.end)
+            # если время начала больше времени окончания (такое бывает, например,
+            # когда местное время старта меньше UTC смещения и преобразуется в UTC), начало - в предыдущем дне
+            if start_offset > end_offset:
+                start_offset -= datetime.timedelta(days=1)
+            schedule_intervals_map[si.day_of_week].append((start_offset, end_offset))
+
+        first_day = datetime.datetime.combine(start.date(), datetime.time(tzinfo=UTC))
+        first_week_day = start.date().weekday() + 1     # в нашем случае первый день недели - ВС, а не ПН
         for i in range((end.date() - start.date()).days + 1):      # перебираем дни с первого по последний, начиная с 0
-            apply_date = (start + datetime.timedelta(days=i)).date()
-            week_day = (apply_date.weekday() + 1) % 7    # в нашем случае первый день недели - ВС, а не ПН
+            week_day = (first_week_day + i) % 7
             if week_day not in schedule_intervals_map:
                 continue
-            for si in schedule_intervals_map[week_day]:
-                apply_start = datetime.datetime.combine(apply_date, si.start)
-                apply_end = datetime.datetime.combine(apply_date, si.end)
-                # если нач. дата больше конечной (такое бывает, например,
-                # когда местное время старта меньше UTC смещения и преобразуется в UTC)
-                if apply_start > apply_end:
-                    apply_start -= datetime.timedelta(days=1)
-                interval = Interval(start=apply_start, end=apply_end, kind=Interval.Kind_OrganizationReserved,
-                                    resource=self.resource, organization=self.organization)
-                # включаем интервал в список созданных интервалов, объединяя перекрывающиеся
-                interval.join_with_existing(intervals)
-                intervals.append(interval)
-
-        for i in intervals:                        # убираем короткие интервалы
-            if i.end - i.start < Interval.JOIN_GAP:
-                intervals.remove(i)
-
-        intervals.sort(key=lambda d: d.start)      # сортируем получившиеся интервалы по возрастанию
+            apply_day = first_day + datetime.timedelta(days=i)
+            for start_offset, end_offset in schedule_intervals_map[week_day]:
+                ranges.append((apply_day + start_offset, apply_day + end_offset))
+
+        # объединяем перекрывающиеся и соприкасающиеся отрезки (результат отсортирован по возрастанию),
+        # короткие интервалы убираем
+        intervals = [Interval(start=s, end=e, kind=Interval.Kind_OrganizationReserved,
+                              resource=self.resource, organization=self.organization)
+                     for s, e in utils.merge_ranges(ranges, Interval.JOIN_GAP) if e - s >= Interval.JOIN_GAP]
+
         if len(intervals):                         # склеиваем первый (и последний) с имеющимися
             intervals[0].join_with_existing()
             if len(intervals) > 1:
                 intervals[-1].join_with_existing()
-        Interval.objects.bulk_create(intervals)    # записываем получившиеся интервалы
+        # записываем получившиеся интервалы
+        Interval.objects.bulk_create(intervals, batch_size=Interval.BULK_CREATE_BATCH_SIZE)
 
         # сохраняем расписание
         if save_as_default and schedule_intervals is not None:
             for si in schedule_intervals:
                 si.membership = self
             self.schedule_intervals.all().delete()
-            ScheduleInterval.objects.bulk_create(schedule_intervals)
+            ScheduleInterval.objects.bulk_create(schedule_intervals, batch_size=ScheduleInterval.BULK_CREATE_BATCH_SIZE)
         return True
 
 
@@ -607,7 +723,7 @@ class ScheduleIntervalManager(models.QuerySet):
         splitted_schedule_intervals = interval.as_schedule_intervals()
         days_of_week = set([i.day_of_week for i in splitted_schedule_intervals])
 
-        for i in self.filter(day_of_week__in=days_of_week):
+        for i in self.filter(day_of_week__in=days_of_week).only('day_of_week', 'start', 'end'):
             for j in splitted_schedule_intervals:
                 if i.has_intersection(j):
                     return True
@@ -618,6 +734,9 @@ class ScheduleInterval(models.Model):
     """
     Фрагмент расписания ресурса в организации. Характеризуется днём недели, временем начала и завершения.
     """
+    # расписание - это десятки фрагментов, одного запроса хватает всегда; пачка - лишь страховка от огромного ввода
+    BULK_CREATE_BATCH_SIZE = 1000
+
     membership = models.ForeignKey(ResourceMembership, related_name='schedule_intervals', on_delete=models.CASCADE)
     day_of_week = models.PositiveSmallIntegerField()
     start = models.TimeField()
@@ -629,9 +748,9 @@ class ScheduleInterval(models.Model):
         """Указывает UTC в качестве временной зоны для 'наивных' self.start и self.end"""
         super().__init__(*args, **kwargs)
         if self.start.tzinfo is None:
-            self.start = self.start.replace(tzinfo=UTC())
+            self.start = self.start.replace(tzinfo=UTC)
         if self.end.tzinfo is None:
-            self.end = self.end.replace(tzinfo=UTC())
+            self.end = self.end.replace(tzinfo=UTC)
 
     def has_intersection(self, other: 'ScheduleInterval'):
         """Пересекаются ли данный и указанный фрагменты расписания между собой"""
@@ -648,11 +767,37 @@ class ApiKey(models.Model):
     Ключ для доступа к данному msa. Характеризуется названием сервиса (app),
     по которому должны фильтроваться выборки всех объектов, наследованных от ApiModelMixIn.
     """
+    CACHE_KEY = 'rcalendar:apikey:%s'
+    CACHE_TIMEOUT = 60
+
     key = models.UUIDField(unique=True, default=uuid.uuid4, editable=False)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     app = models.CharField(max_length=30)
 
+    @classmethod
+    def get_app(cls, key: str) -> str:
+        """
+        Возвращает app для активного ключа key. Результат кешируется на CACHE_TIMEOUT секунд.
+        При отсутствии ключа вызывается ApiKey.DoesNotExist, при невалидном key - ValueError.
+        """
+        cache_key = cls.CACHE_KEY % uuid.UUID(key)
+        app = cache.get(cache_key)
+        if app is None:
+            app = cls.objects.get(key=key, is_active=True).app
+            cache.set(cache_key, app, cls.CACHE_TIMEOUT)
+        return app
+
+    def save(self, *args, **kwargs):
+        """Переопределяет функцию Model.save, сбрасывая закешированный app для данного ключа."""
+        super().save(*args, **kwargs)
+        cache.delete(self.CACHE_KEY % self.key)
+
+    def delete(self, *args, **kwargs):
+        """Переопределяет функцию Model.delete, сбрасывая закешированный app для данного ключа."""
+        cache.delete(self.CACHE_KEY % self.key)
+        return super().delete(*args, **kwargs)
+
 
 ScheduleIntervalList = List[ScheduleInterval]
 IntervalList = List[Interval]
@@ -1,5 +1,8 @@
+from typing import Optional
+
+from django.db.models import Q
 from rest_framework import permissions
-from .models import ApiKey, Manager, Resource
+from .models import ApiKey, Interval
 
 
 class HasValidApiKey(permissions.BasePermission):
@@ -7,7 +10,9 @@ class HasValidApiKey(permissions.BasePermission):
         """Если api-key в заголовках запроса валидный, присваивает app в request и возвращает True, иначе - False."""
         try:
             val = request.META.get('HTTP_API_KEY') or request.GET.get('api_key')
-            app = ApiKey.objects.get(key=val, is_active=True).app
+            if not val:
+                return False
+            app = ApiKey.get_app(val)
             request.app = app       # put found app to request
             return True
         except (ApiKey.DoesNotExist, ValueError):
@@ -15,23 +20,29 @@ class HasValidApiKey(permissions.BasePermission):
 
 
 class IntervalPermission(permissions.BasePermission):
-    def has_object_permission(self, request, view, obj):
-        """если в GET передан author_id и он совпадает с менеджером или ресурсом данного интервала,
-        возвращает True, иначе - False."""
+    """
+    Права на изменение интервалов: менеджеру - на его интервалы, ресурсу - на его интервалы недоступности.
+    Автор запроса передаётся в GET-аргументе author_id.
+    Помимо проверки отдельного объекта, умеет фильтровать queryset (filter_queryset) - DRF этот метод
+    сам не вызывает, его используют групповые действия (см. IntervalViewSet.delete_many).
+    """
+
+    @staticmethod
+    def get_filter(request) -> Optional[Q]:
+        """Условие на интервалы, доступные автору запроса (None, если автор не указан)."""
         author_msa_id = request.GET.get('author_id')
         if not author_msa_id:
-            return False
-
-        manager_qs = Manager.objects.filter(msa_id=author_msa_id, app=request.app)       # maybe author is manager?
-        if manager_qs.exists():
-            manager = manager_qs[0]
-            if obj.manager == manager:
-                return True
+            return None
+        return Q(manager__msa_id=author_msa_id, manager__app=request.app) | \
+            Q(resource__msa_id=author_msa_id, resource__app=request.app, kind=Interval.Kind_Unavailable)
 
-        resource_qs = Resource.objects.filter(msa_id=author_msa_id, app=request.app)       # maybe author is resource?
-        if resource_qs.exists():
-            resource = resource_qs[0]
-            if obj.resource == resource and obj.kind == obj.Kind_Unavailable:
-                return True
+    def has_object_permission(self, request, view, obj):
+        """если в GET передан author_id и он совпадает с менеджером или ресурсом данного интервала,
+        возвращает True, иначе - False."""
+        q = self.get_filter(request)
+        return q is not None and Interval.objects.filter(q, pk=obj.pk).exists()
 
-        return False
+    def filter_queryset(self, request, view, queryset):
+        """Оставляет в queryset интервалов только те, на которые у автора запроса есть права."""
+        q = self.get_filter(request)
+        return queryset.filter(q) if q is not None else queryset.none()
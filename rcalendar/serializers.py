@@ -1,3 +1,5 @@
+from collections import OrderedDict
+
 from rest_framework import serializers
 from .models import Organization, Interval, ResourceMembership, ScheduleInterval
 from .fields import MsaIdRelatedField
@@ -27,13 +29,9 @@ class ResourceMembershipShortSerializer(serializers.ModelSerializer):
 
 
 class OrganizationSerializer(serializers.ModelSerializer):
-    manager_ids = serializers.SerializerMethodField()
+    manager_ids = serializers.SlugRelatedField(source='managers', slug_field='msa_id', many=True, read_only=True)
     resource_members = ResourceMembershipShortSerializer(many=True)
 
-    @staticmethod
-    def get_manager_ids(obj):
-        return obj.managers.values_list('msa_id', flat=True)
-
     class Meta:
         model = Organization
         fields = ('manager_ids', 'resource_members')
@@ -47,9 +45,32 @@ class IntervalSerializer(serializers.ModelSerializer):
         fields = ('id', 'start', 'end', 'kind', 'resource', 'organization', 'manager', 'comment')
 
     def to_representation(self, instance):
-        """добавляет к представлению kind в виде строки и объект, если есть"""
-        ret = super().to_representation(instance)
-        ret['kind'] = instance.get_kind_display()
+        """
+        Добавляет к представлению kind в виде строки и объект, если есть.
+        Набор полей фиксирован, поэтому представление собирается напрямую, без обхода полей сериализатора
+        (заметно быстрее при many=True). Даты форматируются полями сериализатора, как и раньше.
+
+        Если в контексте передан organization_id, у интервалов других организаций скрываются
+        комментарий и менеджер.
+        """
+        fields = self.fields
+        organization = instance.organization
+        manager = instance.manager
+        comment = instance.comment
+        organization_id = self.context.get('organization_id')
+        if organization_id is not None and instance.kind == Interval.Kind_OrganizationReserved \
+                and instance.organization_id != organization_id:
+            manager = comment = None
+        ret = OrderedDict((
+            ('id', instance.id),
+            ('start', fields['start'].to_representation(instance.start)),
+            ('end', fields['end'].to_representation(instance.end)),
+            ('kind', instance.get_kind_display()),
+            ('resource', instance.resource.msa_id),
+            ('organization', organization.msa_id if organization is not None else None),
+            ('manager', manager.msa_id if manager is not None else None),
+            ('comment', comment),
+        ))
         obj_id = instance.get_object(msa_id_only=True)
         if obj_id:
             ret['object'] = obj_id
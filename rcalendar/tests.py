@@ -0,0 +1,100 @@
+import datetime
+import json
+
+from django.test import TestCase
+from django.utils import timezone
+
+from .models import ApiKey, Organization, Resource, ResourceMembership, Interval, ScheduleInterval
+from .views import bulk_get_or_create
+
+
+class BulkGetOrCreateTestCase(TestCase):
+    """bulk_get_or_create: вставка одним запросом и откат к get_or_create при конфликте."""
+
+    def test_creates_all_missing(self):
+        created = bulk_get_or_create(Resource, [Resource(app='test', msa_id=i) for i in (1, 2)], 'app', 'msa_id')
+        self.assertEqual(created, 2)
+        self.assertEqual(Resource.objects.filter(app='test').count(), 2)
+
+    def test_falls_back_on_conflict(self):
+        # объект с msa_id=1 уже создан "одновременным запросом"
+        Resource.objects.create(app='test', msa_id=1)
+        created = bulk_get_or_create(Resource, [Resource(app='test', msa_id=i) for i in (1, 2)], 'app', 'msa_id')
+        self.assertEqual(created, 1)
+        self.assertEqual(Resource.objects.filter(app='test', msa_id=1).count(), 1)
+        self.assertTrue(Resource.objects.filter(app='test', msa_id=2).exists())
+
+
+class DeleteManyTestCase(TestCase):
+    """IntervalViewSet.delete_many удаляет либо все указанные интервалы, либо ни одного."""
+    url = '/api/v1/interval/delete_many/'
+
+    def setUp(self):
+        self.api_key = ApiKey.objects.create(app='test')
+        self.resource = Resource.objects.create(app='test', msa_id=1)
+        start = timezone.now().replace(microsecond=0)
+        Interval.objects.bulk_create([
+            Interval(resource=self.resource, kind=Interval.Kind_Unavailable,
+                     start=start + datetime.timedelta(days=i), end=start + datetime.timedelta(days=i, hours=1))
+            for i in range(2)
+        ])
+        self.ids = list(Interval.objects.values_list('id', flat=True))
+
+    def delete_many(self, ids):
+        return self.client.delete('%s?author_id=%d' % (self.url, self.resource.msa_id),
+                                  data=json.dumps({'ids': ids}), content_type='application/json',
+                                  HTTP_API_KEY=str(self.api_key.key))
+
+    def test_unknown_id_deletes_nothing(self):
+        response = self.delete_many(self.ids + [max(self.ids) + 1000])
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Interval.objects.count(), 2)
+
+    def test_string_ids_rejected(self):
+        response = self.delete_many(''.join(map(str, self.ids)))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Interval.objects.count(), 2)
+
+    def test_deletes_all(self):
+        response = self.delete_many(self.ids)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Interval.objects.exists())
+
+
+class ExtendSchedulesTestCase(TestCase):
+    """ResourceMembershipQuerySet.extend_schedules продлевает только устаревшие расписания."""
+
+    def setUp(self):
+        self.now = timezone.now().replace(microsecond=0)
+        organization = Organization.objects.create(app='test', msa_id=1)
+        resource = Resource.objects.create(app='test', msa_id=1)
+        self.membership = ResourceMembership.objects.create(resource=resource, organization=organization,
+                                                            schedule_extended_date=self.now)
+        ScheduleInterval.objects.bulk_create([
+            ScheduleInterval(membership=self.membership, day_of_week=day,
+                             start=datetime.time(9), end=datetime.time(18))
+            for day in range(7)
+        ])
+
+    def test_extends_outdated(self):
+        end = self.now + datetime.timedelta(days=7)
+        ResourceMembership.objects.filter(id=self.membership.id).extend_schedules(end)
+
+        self.membership.refresh_from_db()
+        self.assertEqual(self.membership.schedule_extended_date, end)
+        self.assertTrue(Interval.objects.filter(resource=self.membership.resource_id,
+                                                kind=Interval.Kind_OrganizationReserved).exists())
+
+    def test_up_to_date_untouched(self):
+        end = self.now + datetime.timedelta(days=7)
+        ResourceMembership.objects.filter(id=self.membership.id).extend_schedules(end)
+        count = Interval.objects.count()
+
+        # повторное продление до той же даты ничего не меняет
+        ResourceMembership.objects.filter(id=self.membership.id).extend_schedules(end)
+        self.assertEqual(Interval.objects.count(), count)
+
+    def test_without_extended_date_skipped(self):
+        ResourceMembership.objects.filter(id=self.membership.id).update(schedule_extended_date=None)
+        ResourceMembership.objects.filter(id=self.membership.id).extend_schedules(self.now + datetime.timedelta(days=7))
+        self.assertFalse(Interval.objects.exists())
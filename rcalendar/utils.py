@@ -1,17 +1,75 @@
 import re
 from datetime import datetime, date, time, timedelta
+from functools import lru_cache
+from typing import Optional
+from django.utils.dateparse import parse_date, parse_datetime, parse_time
 from django.utils.timezone import get_default_timezone
 
 from .exceptions import FormError
 
+_DIGITS_RE = re.compile(r'\d+')
+
 
 def datetime_from_date(d: date) -> datetime:
     """date with 00:00AM local time"""
     return datetime.combine(d, time(tzinfo=get_default_timezone()))
 
 
+def timedelta_from_time(t: time) -> timedelta:
+    """смещение времени t от начала дня (временная зона не учитывается)"""
+    return timedelta(hours=t.hour, minutes=t.minute, seconds=t.second, microseconds=t.microsecond)
+
+
+def merge_ranges(ranges: list, gap: timedelta) -> list:
+    """
+    Объединяет пересекающиеся отрезки (start, end), а также отрезки, промежуток между которыми меньше gap.
+    Возвращает отсортированный по start список непересекающихся отрезков.
+    """
+    ret = []
+    for start, end in sorted(ranges):
+        if ret and start - ret[-1][1] < gap:
+            if end > ret[-1][1]:
+                ret[-1] = (ret[-1][0], end)
+        else:
+            ret.append((start, end))
+    return ret
+
+
+def _fast_parse_date(value: str) -> Optional[date]:
+    """parse_date с быстрым путем через date.fromisoformat (python 3.7+)"""
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        return parse_date(value)
+
+
+def _fast_parse_datetime(value: str) -> Optional[datetime]:
+    """parse_datetime с быстрым путем через datetime.fromisoformat (python 3.7+)"""
+    try:
+        # строку из одной даты parse_datetime не принимает, поэтому и здесь ее не пропускаем
+        if len(value) > 10:
+            return datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    return parse_datetime(value)
+
+
+if hasattr(datetime, 'fromisoformat'):
+    _date_parser, _datetime_parser = _fast_parse_date, _fast_parse_datetime
+else:
+    _date_parser, _datetime_parser = parse_date, parse_datetime
+
+# результаты разбора неизменяемы, поэтому повторяющиеся значения (границы дней/недель) можно кэшировать
+_CACHED_PARSERS = {
+    parse_date: lru_cache(maxsize=4096)(_date_parser),
+    parse_datetime: lru_cache(maxsize=4096)(_datetime_parser),
+    parse_time: lru_cache(maxsize=4096)(parse_time),
+}
+
+
 def parse_args(func, querydict, alloy_empty: bool, *keys: str) -> list:
     """парсит аргументы keys из querydict с помощью func (может быть parse_date, parse_time, parse_datetime)"""
+    func = _CACHED_PARSERS.get(func, func)
     ret = []
     for key in keys:
         if alloy_empty and not querydict.get(key):
@@ -29,8 +87,14 @@ def parse_args(func, querydict, alloy_empty: bool, *keys: str) -> list:
 def str_to_int(s):
     if s is None:
         return 0
+    # быстрый путь для самых частых значений: уже число или строка из цифр
+    if type(s) is int:
+        return s
+    if isinstance(s, str) and s.isdecimal():
+        return int(s)
     try:
         return int(s)
-    except ValueError:
-        nums = re.findall(r'\d+', s)
-        return int(nums[0]) if len(nums) else 0
+    except (TypeError, ValueError):
+        pass
+    m = _DIGITS_RE.search(s) if isinstance(s, str) else None
+    return int(m.group()) if m else 0
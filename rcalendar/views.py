@@ -1,18 +1,19 @@
-import datetime
-
 from rest_framework import viewsets, mixins
 from rest_framework.decorators import list_route, detail_route, api_view
 from rest_framework.exceptions import ParseError, ValidationError, NotFound
 from rest_framework.serializers import ModelSerializer
 from rest_framework import status
 from rest_framework.response import Response
+from rest_framework.renderers import JSONRenderer
 
-from django.db.models import Q, ObjectDoesNotExist
+from django.db import transaction, IntegrityError
+from django.db.models import Q, Exists, OuterRef, ObjectDoesNotExist
 from django.utils.dateparse import parse_datetime
-from django.utils.timezone import get_default_timezone
+from django.utils.timezone import localtime
 from django.utils.translation import ugettext_lazy as _
 from django.utils.formats import localize
 from django.shortcuts import get_object_or_404
+from django.http import StreamingHttpResponse
 
 from . import serializers, permissions, exceptions
 from .models import Organization, Manager, Resource, Interval, ScheduleInterval, ResourceMembership
@@ -20,6 +21,90 @@ from .utils import parse_args
 from .decorators import append_events_data
 from .middleware import EventDispatchMiddleware as EventDispatcher
 
+# типы интервалов, которые видны любой организации (не только своей)
+ORGANIZATION_VISIBLE_KINDS = (Interval.Kind_OrganizationReserved, Interval.Kind_Unavailable)
+
+# сколько интервалов выбирать из бд и отдавать клиенту за раз при потоковой выдаче списков
+INTERVALS_CHUNK_SIZE = 2000
+
+# сообщения ответов (ленивые, переводятся при форматировании)
+SCHEDULE_APPLIED_MSG = _('Resource schedule for this organization has been %s.')
+SCHEDULE_CLEARED_MSG = _('cleared %s')
+SCHEDULE_UPDATED_MSG = _('updated %s')
+SCHEDULE_CREATED_MSG = _('created %s')
+INTERVAL_CREATED_MSG = _('Specified interval has been %s.')
+INTERVAL_CREATED_KIND_MSGS = {
+    Interval.Kind_OrganizationReserved: _('reserved for organization'),
+    Interval.Kind_ManagerReserved: _('reserved'),
+    Interval.Kind_Unavailable: _('marked as unavailable for working'),
+}
+
+
+def get_organization(request, msa_id, lock=False) -> Organization:
+    """
+    Возвращает организацию с указанным msa_id для request.app (при отсутствии - 404).
+    Если стоит флаг lock, строка блокируется (select_for_update) до конца текущей транзакции.
+    """
+    queryset = Organization.objects.select_for_update() if lock else Organization.objects.all()
+    return get_object_or_404(queryset, app=request.app, msa_id=msa_id)
+
+
+def bulk_get_or_create(model, objs: list, *unique_fields: str) -> int:
+    """
+    Создаёт объекты objs одним INSERT и возвращает количество созданных.
+    Если часть из них уже создал одновременный запрос (IntegrityError по уникальному ограничению),
+    вставка откатывается к точке сохранения, и объекты создаются по одному через get_or_create по полям unique_fields.
+    Защищает от дубликатов, только если по unique_fields в бд есть уникальное ограничение.
+    """
+    if not objs:
+        return 0
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create(objs)
+        return len(objs)
+    except IntegrityError:
+        created = 0
+        for obj in objs:
+            _obj, is_new = model.objects.get_or_create(**{f: getattr(obj, f) for f in unique_fields})
+            created += is_new
+        return created
+
+
+def stream_intervals(queryset, context: dict=None) -> StreamingHttpResponse:
+    """
+    Отдаёт интервалы из queryset JSON-массивом по частям (по INTERVALS_CHUNK_SIZE),
+    так что в памяти одновременно находится только одна часть, а не весь список.
+    Каждый интервал сериализуется IntervalSerializer с контекстом context.
+    """
+    serializer = serializers.IntervalSerializer(context=context or {})
+    renderer = JSONRenderer()
+
+    def generate():
+        yield b'['
+        chunk = []
+        first = True
+        for instance in queryset.iterator(chunk_size=INTERVALS_CHUNK_SIZE):
+            chunk.append(renderer.render(serializer.to_representation(instance)))
+            if len(chunk) == INTERVALS_CHUNK_SIZE:
+                yield (b'' if first else b',') + b','.join(chunk)
+                chunk, first = [], False
+        if chunk:
+            yield (b'' if first else b',') + b','.join(chunk)
+        yield b']'
+
+    return StreamingHttpResponse(generate(), content_type='application/json')
+
+
+def parse_ids(value) -> set:
+    """Возвращает множество целых чисел из списка value (аргумент ids); при неверном формате - ParseError."""
+    # строку не перебираем посимвольно: '12' - это не ids [1, 2]
+    if not isinstance(value, (list, tuple)):
+        raise ParseError({'ids': _('A list of integers is required.')})
+    try:
+        return set(map(int, value))
+    except (TypeError, ValueError):
+        raise ParseError({'ids': _('A valid integer is required.')})
+
 
 @api_view()
 # @permission_classes((permissions.ValidApiKeyOrSuperuserOrDenied, ))
@@ -53,9 +138,9 @@ class FilterByAppViewSet:
     - фильтрует выборки по request.app
     """
     def create(self, request, *args, **kwargs):
-        id = request.data.pop('id')
-        request.data['msa_id'] = id
-        request.data['app'] = request.app
+        data = request.data
+        data['msa_id'] = data.pop('id')
+        data['app'] = request.app
         return super().create(request, *args, **kwargs)
 
     def get_queryset(self):
@@ -76,6 +161,14 @@ class OrganizationViewSet(FilterByAppViewSet,
     permission_classes = (permissions.HasValidApiKey,)
     lookup_field = 'msa_id'
 
+    def get_queryset(self):
+        """Для сериализации организации заранее выбирает её менеджеров и участников."""
+        queryset = super().get_queryset()
+        if self.action == 'retrieve':
+            queryset = queryset.prefetch_related('managers', 'resource_members__resource',
+                                                 'resource_members__schedule_intervals')
+        return queryset
+
     @detail_route()
     def intervals(self, request, msa_id):
         """
@@ -90,10 +183,8 @@ class OrganizationViewSet(FilterByAppViewSet,
 
         # интервалы, относящиеся к текущей организации или к организациям вообще
         intervals = Interval.objects.between(start, end).filter(
-            Q(organization=org) |
-            Q(kind=Interval.Kind_OrganizationReserved) |
-            Q(kind=Interval.Kind_Unavailable)
-        )
+            Q(organization=org) | Q(kind__in=ORGANIZATION_VISIBLE_KINDS)
+        ).for_serialization()
 
         if resource_msa_id:
             intervals = intervals.filter(resource__app=request.app, resource__msa_id=resource_msa_id)
@@ -103,32 +194,16 @@ class OrganizationViewSet(FilterByAppViewSet,
             intervals = intervals.filter(resource_id__in=resource_ids)
             memberships = ResourceMembership.objects.filter(resource_id__in=resource_ids)
 
-        for membership in memberships.prefetch_related('schedule_intervals'):
-            membership.extend_schedule(end)  # продлеваем расписание до конечной просматриваемой даты
-
-        # фильтруем интервалы, попадающие в интервалы других организаций
-        other_org_interval_ranges = {}     # ключ: resource_id, значения: [(start, end), ...]
-        filtered_intervals = []
-        for i in intervals:
-            add = True
-            if i.kind == Interval.Kind_OrganizationReserved and i.organization_id != org.id:
-                # найден интервал другой орг-ии
-                i.comment = None      # скрываем комментарий
-                i.manager = None      # скрываем менеджера
-                other_org_interval_ranges.setdefault(i.resource_id, [])
-                other_org_interval_ranges[i.resource_id].append((i.start, i.end))
-
-            if i.resource_id in other_org_interval_ranges and i.kind != i.Kind_OrganizationReserved:
-                # найден интервал ресурса, попадающий в др. орг-ию
-                for r in other_org_interval_ranges[i.resource_id]:
-                    if r[0] <= i.start and r[1] >= i.end:
-                        add = False
-                        break
-            if add:
-                filtered_intervals.append(i)
-
-        data = serializers.IntervalSerializer(filtered_intervals, many=True).data
-        return Response(data)
+        memberships.extend_schedules(end)  # продлеваем расписание до конечной просматриваемой даты
+
+        # исключаем интервалы ресурса, целиком попадающие в интервалы других организаций
+        other_org_intervals = Interval.objects.filter(kind=Interval.Kind_OrganizationReserved).exclude(organization=org)
+        intervals = intervals.annotate(covered=Exists(other_org_intervals.filter(
+            resource=OuterRef('resource'), start__lte=OuterRef('start'), end__gte=OuterRef('end')
+        ))).exclude(kind__in=(Interval.Kind_ManagerReserved, Interval.Kind_Unavailable), covered=True)
+
+        # у интервалов других организаций сериализатор скрывает комментарий и менеджера
+        return stream_intervals(intervals, context={'organization_id': org.id})
 
 
 class ManagerViewSet(FilterByAppViewSet,
@@ -147,8 +222,10 @@ class ManagerViewSet(FilterByAppViewSet,
         if 'organization' in request.GET:
             instance = self.get_object()
             organization_msa_id = request.GET.get('organization')
-            organization = Organization.objects.get(app=request.app, msa_id=organization_msa_id)
-            instance.organizations.remove(organization)
+            with transaction.atomic():
+                # блокируем организацию, как и add_many: состав её менеджеров меняется последовательно
+                organization = get_organization(request, organization_msa_id, lock=True)
+                instance.organizations.remove(organization)
             return Response()
 
         return super().destroy(request, *args, **kwargs)
@@ -159,22 +236,34 @@ class ManagerViewSet(FilterByAppViewSet,
         Создаёт (при необходимости) менеджеров с указанными ids и назначает их в указанную организацию.
         Аргументы ids и organization обязательны.
         """
-        msa_ids = request.data.get('ids')
-        organization_msa_id = request.data.get('organization')
+        data = request.data
+        msa_ids = data.get('ids')
+        organization_msa_id = data.get('organization')
 
         if not msa_ids:
             raise ParseError({'ids': _('This field is required.')})
         if not organization_msa_id:
             raise ParseError({'organization': _('This field is required.')})
 
-        organization = Organization.objects.get(app=request.app, msa_id=organization_msa_id)
-        count = 0
-        for msa_id in msa_ids:
-            if not organization.managers.filter(msa_id=msa_id).exists():
-                obj, created = Manager.objects.get_or_create(app=request.app, msa_id=msa_id)
-                organization.managers.add(obj)
-                count += 1
-        return Response({'count': count}, status=status.HTTP_201_CREATED)
+        msa_ids = parse_ids(msa_ids)
+
+        with transaction.atomic():
+            # блокируем организацию: одновременные add_many для неё выполняются последовательно
+            organization = get_organization(request, organization_msa_id, lock=True)
+            # менеджеры, которых еще нет в организации
+            missing = msa_ids - set(organization.managers.filter(msa_id__in=msa_ids).values_list('msa_id', flat=True))
+            if missing:
+                managers = Manager.objects.filter(app=request.app, msa_id__in=missing)
+                existing = set(managers.values_list('msa_id', flat=True))
+                bulk_get_or_create(Manager, [Manager(app=request.app, msa_id=i) for i in missing - existing],
+                                   'app', 'msa_id')
+                # связи с организацией вставляем напрямую, без проверок managers.add()
+                membership_model = Manager.organizations.through
+                bulk_get_or_create(membership_model, [
+                    membership_model(manager_id=manager_id, organization_id=organization.id)
+                    for manager_id in managers.values_list('id', flat=True)
+                ], 'manager_id', 'organization_id')
+        return Response({'count': len(missing)}, status=status.HTTP_201_CREATED)
 
 
 class ResourceViewSet(FilterByAppViewSet,
@@ -191,25 +280,35 @@ class ResourceViewSet(FilterByAppViewSet,
         Создаёт (при необходимости) ресурсы с указанными ids.
         Если указан аргумент organization, присоединяет их к указанной организации.
         """
-        msa_ids = request.data.get('ids')
-        msa_organization_id = request.data.get('organization')
+        data = request.data
+        msa_ids = data.get('ids')
+        msa_organization_id = data.get('organization')
 
         if not msa_ids:
             raise ParseError({'ids': _('This field is required.')})
 
-        count = 0
-        joined = 0
-        if msa_organization_id:
-            organization = get_object_or_404(Organization, app=request.app, msa_id=msa_organization_id)
+        parsed_ids = parse_ids(msa_ids)
+        joined = len(msa_ids) if msa_organization_id else 0
+        msa_ids = parsed_ids
+
+        resources = Resource.objects.filter(app=request.app, msa_id__in=msa_ids)
+        with transaction.atomic():
+            if msa_organization_id:
+                # блокируем организацию: одновременные add_many для неё выполняются последовательно
+                organization = get_organization(request, msa_organization_id, lock=True)
+
+            missing = msa_ids - set(resources.values_list('msa_id', flat=True))
+            created = bulk_get_or_create(Resource, [Resource(app=request.app, msa_id=i) for i in missing],
+                                         'app', 'msa_id')
 
-        for msa_id in msa_ids:
-            obj, created = Resource.objects.get_or_create(app=request.app, msa_id=msa_id)
             if msa_organization_id:
-                obj.join_organization(organization, raise_if_joined=False)
-                joined += 1
-            if created:
-                count += 1
-        return Response({'created': count, 'joined': joined}, status=status.HTTP_201_CREATED)
+                resource_ids = set(resources.values_list('id', flat=True))
+                resource_ids -= set(organization.resource_members.filter(resource_id__in=resource_ids)
+                                    .values_list('resource_id', flat=True))
+                bulk_get_or_create(ResourceMembership,
+                                   [ResourceMembership(resource_id=i, organization=organization) for i in resource_ids],
+                                   'resource_id', 'organization_id')
+        return Response({'created': created, 'joined': joined}, status=status.HTTP_201_CREATED)
 
     @detail_route(['GET', 'PUT', 'DELETE'])
     # @append_events_data()
@@ -223,7 +322,7 @@ class ResourceViewSet(FilterByAppViewSet,
         """
         obj = self.get_object()
         msa_organization_id = request.data.get('organization') or request.GET.get('organization')
-        organization = get_object_or_404(Organization, app=request.app, msa_id=msa_organization_id)
+        organization = get_organization(request, msa_organization_id)
 
         try:
             if request.method == 'GET':
@@ -253,9 +352,10 @@ class ResourceViewSet(FilterByAppViewSet,
 
         В ответе вернёт {'detail': blahblah, 'events': список пользовательских событий}
         """
-        organization_msa_id = request.data.get('organization') or request.GET.get('organization')
-        start, end = parse_args(parse_datetime, request.data, True, 'start', 'end')
-        intervals_raw = request.data.get('schedule_intervals')
+        data = request.data
+        organization_msa_id = data.get('organization') or request.GET.get('organization')
+        start, end = parse_args(parse_datetime, data, True, 'start', 'end')
+        intervals_raw = data.get('schedule_intervals')
         intervals = []
 
         permanent = not end
@@ -272,14 +372,14 @@ class ResourceViewSet(FilterByAppViewSet,
                                        resource__msa_id=msa_id,
                                        resource__app=request.app,
                                        organization__msa_id=organization_msa_id)
-        detail_str = _('Resource schedule for this organization has been %s.')
+        detail_str = SCHEDULE_APPLIED_MSG
 
         if do_clear:
-            detail_str %= _('cleared %s')
-        elif membership.schedule_intervals.count():
-            detail_str %= _('updated %s')
+            detail_str %= SCHEDULE_CLEARED_MSG
+        elif membership.schedule_intervals.exists():
+            detail_str %= SCHEDULE_UPDATED_MSG
         else:
-            detail_str %= _('created %s')
+            detail_str %= SCHEDULE_CREATED_MSG
 
         if start and end:
             detail_str %= _('from %s to %s') % (localize(start), localize(end))
@@ -291,15 +391,19 @@ class ResourceViewSet(FilterByAppViewSet,
             detail_str %= _('from now on')
 
         if not start:
-            start = datetime.datetime.now(get_default_timezone())
+            start = localtime()
 
         if not end:
             end = start + Interval.EXTENDABLE_INTERVALS_MIN_DURATION
 
-        if membership.apply_schedule(start, end, intervals, save_as_default=permanent):
-            if permanent or not membership.schedule_extended_date or membership.schedule_extended_date < end:
+        with transaction.atomic():
+            applied = membership.apply_schedule(start, end, intervals, save_as_default=permanent)
+            if applied and (permanent or not membership.schedule_extended_date or
+                            membership.schedule_extended_date < end):
                 membership.schedule_extended_date = end
-                membership.save()
+                membership.save(update_fields=('schedule_extended_date',))
+
+        if applied:
             manager_id = request.GET.get('author_id')
             EventDispatcher.push_event_to_response(kind='apply-schedule',
                                                    manager=manager_id,
@@ -321,12 +425,11 @@ class ResourceViewSet(FilterByAppViewSet,
         start, end = parse_args(parse_datetime, request.GET, False, 'start', 'end')
         resource = self.get_object()
 
-        for membership in resource.organization_memberships.all():
-            membership.extend_schedule(end)      # продлеваем расписание до конечной просматриваемой даты
+        # продлеваем расписание до конечной просматриваемой даты
+        resource.organization_memberships.extend_schedules(end)
 
-        intervals = Interval.objects.between(start, end).filter(resource=resource)
-        data = serializers.IntervalSerializer(intervals, many=True).data
-        return Response(data)
+        intervals = Interval.objects.between(start, end).filter(resource=resource).for_serialization()
+        return stream_intervals(intervals)
 
     @detail_route(['POST'])
     @append_events_data()
@@ -355,20 +458,15 @@ class IntervalViewSet(mixins.CreateModelMixin,
     @append_events_data()
     def create(self, request, *args, **kwargs):
         """Переопределяет ф-ию create с целью вернуть в ответе сообщение в detail и список пользовательских событий."""
-        kind = request.data.get('kind')
+        data = request.data
+        kind = data.get('kind')
         if isinstance(kind, str):
             kind = Interval.kind_from_str(kind)
-            request.data['kind'] = kind
+            data['kind'] = kind
         ret = super().create(request, *args, **kwargs)
 
-        msg = _('Specified interval has been %s.')
-        detail_msg = {
-            Interval.Kind_OrganizationReserved: msg % _('reserved for organization'),
-            Interval.Kind_ManagerReserved: msg % _('reserved'),
-            Interval.Kind_Unavailable: msg % _('marked as unavailable for working'),
-        }
-        if kind in detail_msg:
-            ret.data = {'detail': detail_msg[kind]}
+        if kind in INTERVAL_CREATED_KIND_MSGS:
+            ret.data = {'detail': INTERVAL_CREATED_MSG % INTERVAL_CREATED_KIND_MSGS[kind]}
         return ret
 
     @append_events_data()
@@ -386,7 +484,28 @@ class IntervalViewSet(mixins.CreateModelMixin,
         В ответе вернёт список пользовательских событий.
         """
         ids = request.data.get('ids')
-        for id in ids:
-            self.kwargs = {'pk': id}
-            self.destroy(request)
+        if not ids:
+            raise ParseError({'ids': _('This field is required.')})
+        ids = parse_ids(ids)
+
+        with transaction.atomic():
+            # блокируем удаляемые строки (только самого интервала: связанные таблицы присоединяются через outer join)
+            instances = list(self.get_queryset().select_for_update(of=('self',)).filter(id__in=ids))
+            if len(instances) != len(ids):
+                raise NotFound
+
+            # права проверяем до удаления, чтобы не удалить интервалы частично;
+            # права с проверкой на уровне queryset проверяются одним запросом
+            for permission in self.get_permissions():
+                if hasattr(permission, 'filter_queryset'):
+                    allowed = permission.filter_queryset(request, self, Interval.objects.filter(id__in=ids))
+                    permitted = allowed.count() == len(ids)
+                else:
+                    permitted = all(permission.has_object_permission(request, self, i) for i in instances)
+                if not permitted:
+                    self.permission_denied(request, message=getattr(permission, 'message', None))
+
+            for instance in instances:
+                instance.push_delete_events()
+            Interval.objects.filter(id__in=ids).delete()
         return Response()